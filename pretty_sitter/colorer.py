@@ -1,7 +1,10 @@
 import contextlib
+import functools
 import re
 from typing import Callable, ClassVar, Generator
 
+_ANSI_RE = re.compile(r'\033\[[0-9;]*m')
+
 
 class Colorer:
     COLOR_MAP: ClassVar[dict[str, int]] = dict(
@@ -14,6 +17,13 @@ class Colorer:
         gray=37,
     )
     Brush: ClassVar[type] = Callable[[str], str] | Callable[[str, bool | None], str]
+    # Escape sequence prefixes keyed by (bold, by_number), all that is left is the color and 'm'
+    _PREFIX: ClassVar[dict[tuple[bool, bool], str]] = {
+        (False, False): '\033[',
+        (True, False): '\033[1;4;',
+        (False, True): '\033[38;5;',
+        (True, True): '\033[1;4;38;5;',
+    }
 
     _boldworthy: Callable[[str], bool]
 
@@ -22,6 +32,14 @@ class Colorer:
             self._boldworthy = lambda _: bold
         else:
             self._boldworthy = bold
+        # Set the brushes as actual attributes, so that `__getattr__` is reached only for undefined colors
+        for name, color in self.COLOR_MAP.items():
+            # Bound positionally, keyword arguments would be merged into a new dict on every call
+            brush = functools.partial(
+                self._paint, f'{self._PREFIX[False, False]}{color}m', f'{self._PREFIX[True, False]}{color}m',
+            )
+            brush.color = name
+            setattr(self, name, brush)
 
     @contextlib.contextmanager
     def persist(self, *, bold: bool) -> Generator[None, None, None]:
@@ -30,29 +48,46 @@ class Colorer:
         yield
         self._boldworthy = old_worthy
 
-    def _apply(self, text: str, color: int, *, modifiers=()) -> str:
-        if self._boldworthy(text):
-            modifiers = (1, 4, *modifiers, color)
-        else:
-            modifiers = (*modifiers, color)
-        return '\033[' + ';'.join(map(str, modifiers)) + 'm' + text + '\033[0m'
+    def _apply(self, text: str, color: int, *, by_number: bool = False) -> str:
+        prefix = self._PREFIX[bool(self._boldworthy(text)), by_number]
+        return f'{prefix}{color}m{text}\033[0m'
+
+    def _paint(self, start: str, bold_start: str, text: str) -> str:
+        # Same as `_apply` with the escape sequences already complete
+        return f'{bold_start if self._boldworthy(text) else start}{text}\033[0m'
 
     def __getattr__(self, item: str) -> Brush:
-        if item in self.COLOR_MAP:
-            def _brush(text: str) -> str:
-                return self._apply(text, self.COLOR_MAP[item])
-            _brush.color = item
-            return _brush
         raise NotImplementedError(
             f'color {item} undefined; defined colors are: {tuple(self.COLOR_MAP.keys())}'
         )
 
     def __getitem__(self, item) -> Brush:
-        return self.__getattr__(item)
+        return getattr(self, item)
+
+    def by_number(self, number: int, text: str) -> str:
+        return self._apply(text, number * 10, by_number=True)
+
+    @staticmethod
+    def uncolor(text: str) -> str:
+        return _ANSI_RE.sub('', text)
+
+
+def _unchanged(text: str) -> str:
+    return text
+
+
+class PlainColorer(Colorer):
+    def __init__(self, bold: bool | Callable[[str], bool] = False):
+        super().__init__(bold)
+        for name in self.COLOR_MAP:
+            setattr(self, name, _unchanged)
+
+    def _apply(self, text: str, color: int, *, by_number: bool = False) -> str:
+        return text
 
     def by_number(self, number: int, text: str) -> str:
-        return self._apply(text, number * 10, modifiers=(38, 5))
+        return text
 
     @staticmethod
     def uncolor(text: str) -> str:
-        return re.sub(r'\033\[[0-9;]*m', '', text)
+        return text
@@ -23,8 +23,8 @@ class UIConfig(Config):
 
 @dataclass
 class FilterConfig(Config):
-    excluded_types: list[str] | None = None
-    only_types: list[str] | None = None
+    excluded_types: list[str] | frozenset[str] | None = None
+    only_types: list[str] | frozenset[str] | None = None
 
 
 Mark = tuple[str, str, list[Node]]
@@ -1,16 +1,21 @@
 import contextlib
+import io
 import os
 import subprocess
 import sys
-from functools import reduce
-from time import sleep
-from typing import Generator
+from typing import Generator, TextIO
 
 from tree_sitter import Node
 
-from pretty_sitter.colorer import Colorer
+from pretty_sitter.colorer import Colorer, PlainColorer
 from pretty_sitter.config import Config, _CombinedConfig
 
+# Debug lines start with a gray 'DEBUG:', these are all the ways it may appear in the printed text
+_DEBUG_PREFIXES = tuple(
+    colorer.gray('DEBUG:').removesuffix('\033[0m')
+    for colorer in (PlainColorer(), Colorer(bold=False), Colorer(bold=True))
+)
+
 
 class PrettySitter:
     def __init__(
@@ -20,72 +25,168 @@ class PrettySitter:
         self._config = _CombinedConfig()
         self._configure(*configs)
         self._colorer = Colorer(self._boldworthy)
+        self._plain_colorer = PlainColorer(self._boldworthy)
+        # Per-node memoization of the predicates, only valid during a single traversal (see `_traversal`)
+        self._text_cache: dict[Node, str] = {}
+        self._nontrivial_cache: dict[Node, bool] = {}
+        self._included_cache: dict[Node, bool] = {}
+        self._printworthy_cache: dict[Node, bool] = {}
+        self._leaf_cache: dict[Node, bool] = {}
+        # Indentation and colored parentheses per depth, grown as deeper nodes are reached during a traversal
+        self._indents: list[str] = []
+        self._open_pars: list[str] = []
+        self._closed_pars: list[str] = []
+        # Where lines printed during a traversal go, either a buffer written out all at once when it is done, or
+        # the input of the pager
+        self._output: TextIO = io.StringIO()
+        # Decoded text of the traversed tree along with its starting byte, set only if it is pure ASCII (so that
+        # byte offsets are also character offsets)
+        self._source: str | None = None
+        self._source_start = 0
 
     def _configure(self, *configs: Config):
-        combined_dict = reduce(dict.__or__, [c.__dict__ for c in configs], self._config.__dict__)
+        combined_dict = dict(self._config.__dict__)
+        for config in configs:
+            combined_dict.update(config.__dict__)
         self._config = _CombinedConfig(**combined_dict)
+        # Type filters are only used for membership tests
+        if self._config.excluded_types is not None:
+            self._config.excluded_types = frozenset(self._config.excluded_types)
+        if self._config.only_types is not None:
+            self._config.only_types = frozenset(self._config.only_types)
+        # A node found in several marks gets the color of the first one
+        self._mark_colors: dict[Node, str] = {}
+        for _, color, nodes in self._config.marks:
+            for node in nodes:
+                self._mark_colors.setdefault(node, color)
 
     @contextlib.contextmanager
     def configure(self, *configs: Config) -> Generator[None, None, None]:
-        old_config = self._config
+        old_config, old_mark_colors = self._config, self._mark_colors
         self._configure(*configs)
-        yield
-        self._config = old_config
+        try:
+            yield
+        finally:
+            self._config, self._mark_colors = old_config, old_mark_colors
 
-    @staticmethod
-    def _text(n: Node) -> str:
-        node_text = n.text.decode('utf8')
-        node_text = node_text.replace('\n', r'\n')
+    @contextlib.contextmanager
+    def _traversal(self, root: Node) -> Generator[None, None, None]:
+        caches = (
+            self._text_cache, self._nontrivial_cache, self._included_cache, self._printworthy_cache, self._leaf_cache,
+            self._indents, self._open_pars, self._closed_pars,
+        )
+        for cache in caches:
+            cache.clear()
+        self._output = io.StringIO()
+        source = root.text.decode('utf8')
+        if source.isascii():
+            self._source, self._source_start = source, root.start_byte
+        # Specialize the predicates that are trivial under the current configuration
+        specialized = {}
+        if self._config.excluded_types is None:
+            specialized['_excluded'] = lambda _: False
+        if self._config.only_types is None:
+            specialized['_included'] = lambda _: True
+        if self._config.excluded_types is None and self._config.only_types is None:
+            # Without type filters, only triviality decides, and it is memoized on its own
+            specialized['_printworthy'] = (lambda _: True) if self._config.with_trivial else self._nontrivial
+        vars(self).update(specialized)
+        # Without color, do not bother coloring only to uncolor right before printing
+        colorer = self._colorer
+        if not self._config.print_with_color:
+            self._colorer = self._plain_colorer
+        # Restored even if printing is interrupted, as leftover overrides or caches would affect the next traversal
+        try:
+            yield
+        finally:
+            self._colorer = colorer
+            for name in specialized:
+                delattr(self, name)
+            for cache in caches:
+                cache.clear()
+            self._output = io.StringIO()
+            self._source = None
+
+    def _text(self, n: Node) -> str:
+        if (node_text := self._text_cache.get(n)) is None:
+            if self._source is not None:
+                node_text = self._source[n.start_byte - self._source_start:n.end_byte - self._source_start]
+            else:
+                node_text = n.text.decode('utf8')
+            if '\n' in node_text:
+                node_text = node_text.replace('\n', r'\n')
+            self._text_cache[n] = node_text
         return node_text
 
     def _nontrivial(self, n: Node) -> bool:
-        return n.type != self._text(n)
+        if (nontrivial := self._nontrivial_cache.get(n)) is None:
+            nontrivial = self._nontrivial_cache[n] = n.type != self._text(n)
+        return nontrivial
 
     def _excluded(self, n: Node) -> bool:
         return self._config.excluded_types is not None and n.type in self._config.excluded_types
 
     def _included(self, n: Node) -> bool:
-        if self._config.only_types is None:
+        if (only_types := self._config.only_types) is None:
             return True
-        if len(n.children) == 0:
-            return n.type in self._config.only_types
-        return any(self._included(c) for c in n.children)
+        cache = self._included_cache
+        if (included := cache.get(n)) is None:
+            # Decide the whole subtree in a single post-order pass (each node right after its children) with an
+            # explicit stack, rather than recursing into every child
+            stack = [(n, False)]
+            while stack:
+                m, children_done = stack.pop()
+                if m in cache:
+                    continue
+                children = m.children
+                if len(children) == 0:
+                    cache[m] = m.type in only_types
+                elif children_done:
+                    cache[m] = any(cache[c] for c in children)
+                else:
+                    stack.append((m, True))
+                    stack.extend((c, False) for c in children)
+            included = cache[n]
+        return included
 
     def _printworthy(self, n: Node) -> bool:
-        return not any((
-            self._excluded(n),
-            not self._included(n),
-            not self._config.with_trivial and not self._nontrivial(n),
-        ))
+        if (printworthy := self._printworthy_cache.get(n)) is None:
+            # Cheapest first: a type lookup, then a text comparison, then a lookup over the whole subtree
+            printworthy = self._printworthy_cache[n] = not (
+                self._excluded(n)
+                or (not self._config.with_trivial and not self._nontrivial(n))
+                or not self._included(n)
+            )
+        return printworthy
 
     def _boldworthy(self, node_type: str) -> bool:
         return self._config.only_types is not None and node_type in self._config.only_types
 
     def _leaf(self, n: Node) -> bool:
-        if len(n.children) == 0:
-            return True
-        return not self._config.with_trivial and not any(self._nontrivial(c) for c in n.children)
-
-    def _column(self, text: str) -> str:
-        # Note: we cannot use print(f'{text:<width}') because color codes count as characters
+        if (leaf := self._leaf_cache.get(n)) is None:
+            if len(n.children) == 0:
+                leaf = True
+            else:
+                leaf = not self._config.with_trivial and not any(self._nontrivial(c) for c in n.children)
+            self._leaf_cache[n] = leaf
+        return leaf
+
+    def _column(self, text: str, visible_len: int) -> str:
+        # Note: we cannot use print(f'{text:<width}') because color codes count as characters,
+        # hence the caller keeps track of the visible length of `text`
+        pad = self._config.column_width - visible_len
         if self._config.dotted:
-            return text + ' ' + Colorer.gray('.' * (self._config.column_width - len(self._colorer.uncolor(text)) + 2)) + ' '
-        return text + ' ' * (self._config.column_width - len(self._colorer.uncolor(text)))
+            return f"{text} {self._colorer.gray('.' * (pad + 2))} "
+        return text + ' ' * pad
 
     def _print(self, text: str):
-        uncolored = self._colorer.uncolor(text)
-        if self._config.debug_only and not uncolored.startswith('DEBUG:'):
+        if self._config.debug_only and not text.startswith(_DEBUG_PREFIXES):
             return
-        text_to_print = text if self._config.print_with_color else uncolored
-        if self._config.use_pager:
-            if not hasattr(self._print, 'pager_lines'):
-                self._print.pager_lines = []
-            self._print.pager_lines.append(text_to_print)
-        else:
-            print(text_to_print)
+        self._output.write(text)
+        self._output.write('\n')
 
-    def _find_mark(self, n: Node) -> Colorer.Brush | None:
-        return next((brush for name, brush, nodes in self._config.marks if n in nodes), None)
+    def _find_mark(self, n: Node) -> str | None:
+        return self._mark_colors.get(n)
 
     def _color_legend(self) -> list[str]:
         with self._colorer.persist(bold=False):
@@ -107,82 +208,118 @@ class PrettySitter:
             return self._colorer.cyan
         return self._colorer.gray
 
+    def _ensure_depth(self, depth: int):
+        while (d := len(self._indents)) <= depth:
+            self._indents.append(' ' * self._config.indent_size * d)
+            self._open_pars.append(self._colorer.by_number(d, '('))
+            self._closed_pars.append(self._colorer.by_number(d, ')'))
+
     def _indent(self, depth: int, text: str) -> str:
-        indent = ' ' * self._config.indent_size * depth
-        return indent + text
-
-    def _print_node(self, n: Node, attr_name_in_parent: str | None = None, depth=0, end='') -> bool:
-        attr_name_in_parent = attr_name_in_parent + ': ' if attr_name_in_parent is not None else ''
-        node_text = self._text(n)
-        node_type = n.type
-        node_line = n.start_point[0]
-        node_name = node_type if n.is_named else '"' + node_type.replace('"', r'\"') + '"'
-
-        if not self._printworthy(n):
-            if self._config.debug:
+        self._ensure_depth(depth)
+        return self._indents[depth] + text
+
+    @staticmethod
+    def _colored(text: str, brush: Colorer.Brush) -> tuple[str, int]:
+        return brush(text), len(text)
+
+    def _print_tree(self, root: Node):
+        cfg = self._config
+        debug = cfg.debug
+        with_text = cfg.with_text
+        close_early = cfg.close_pars_early
+        gray = self._colorer.gray
+        print_ = self._print
+        printworthy = self._printworthy
+
+        # Nodes are visited in pre-order using an explicit stack rather than recursion. Each entry holds a node,
+        # its field name in its parent, its depth, and the closing parentheses to print after it (along with their
+        # visible length). An entry without a node stands for the closing line of a node with printed children,
+        # which is only used when not `close_pars_early`.
+        stack: list[tuple[Node | None, str | None, int, str, int]] = [(root, None, 0, '', 0)]
+        while stack:
+            n, attr_name_in_parent, depth, end, end_len = stack.pop()
+            if n is None:
+                print_(self._indent(depth, self._closed_pars[depth]))
+                continue
+
+            attr_name_in_parent = attr_name_in_parent + ': ' if attr_name_in_parent is not None else ''
+            node_text = self._text(n)
+            node_type = n.type
+            node_name = node_type if n.is_named else '"' + node_type.replace('"', r'\"') + '"'
+
+            if not printworthy(n):
+                if debug:
+                    text_quoted = node_text.replace("'", r"\'")
+                    text_truncated = text_quoted[:12] + '...' if len(text_quoted) > 15 else text_quoted
+                    print_(
+                        gray(f"DEBUG: 🔴 skipped node_name=")
+                        + node_name
+                        + gray(f", text='{text_truncated}'")
+                        + gray(f", {depth=}, end='")
+                        + end
+                        + gray("'")
+                    )
+                continue
+
+            first_color = self._obtain_first_color(n)
+            node_name_colored, node_name_len = self._colored(node_name, first_color)
+
+            if debug:
                 text_quoted = node_text.replace("'", r"\'")
                 text_truncated = text_quoted[:12] + '...' if len(text_quoted) > 15 else text_quoted
-                self._print(
-                    self._colorer.gray(f"DEBUG: 🔴 skipped node_name=")
-                    + node_name
-                    + self._colorer.gray(f", text='{text_truncated}'")
-                    + self._colorer.gray(f", {depth=}, end='")
+                print_(
+                    gray(f"DEBUG: 🟢 entered node_name=")
+                    + node_name_colored
+                    + gray(f", text='{text_truncated}'")
+                    + gray(f", {depth=}, end='")
                     + end
-                    + self._colorer.gray("'")
+                    + gray("'")
                 )
-            return False
-
-        first_color = self._obtain_first_color(n)
-        second_color = self._obtain_second_color(n)
-
-        node_name_colored = first_color(node_name)
-        node_text_colored = second_color(node_text)
-
-        if self._config.debug:
-            text_quoted = node_text.replace("'", r"\'")
-            text_truncated = text_quoted[:12] + '...' if len(text_quoted) > 15 else text_quoted
-            self._print(
-                self._colorer.gray(f"DEBUG: 🟢 entered node_name=")
-                + node_name_colored
-                + self._colorer.gray(f", text='{text_truncated}'")
-                + self._colorer.gray(f", {depth=}, end='")
-                + end
-                + self._colorer.gray("'")
-            )
-
-        open_par = self._colorer.by_number(depth, '(')
-        closed_par = self._colorer.by_number(depth, ')')
-
-        first_part = self._indent(depth, f'{attr_name_in_parent}{open_par}{node_name_colored}')
-        second_part = self._colorer.gray(f"{node_line:>3}: ") + node_text_colored
-
-        end = closed_par + end
-        try:
-            last_printworthy_child = next(c for c in reversed(n.children) if self._printworthy(c))
-        except StopIteration:
-            last_printworthy_child = None
 
-        if last_printworthy_child is not None:  # i.e. there is at least one child to be printed
-            if not self._config.with_text:
-                self._print(first_part)
-            else:
-                self._print(self._column(first_part) + second_part)
-
-            for i, child in enumerate(n.children):
-                self._print_node(
+            self._ensure_depth(depth)
+            open_par = self._open_pars[depth]
+            closed_par = self._closed_pars[depth]
+
+            indent = self._indents[depth]
+            first_part = f'{indent}{attr_name_in_parent}{open_par}{node_name_colored}'
+            first_part_len = len(indent) + len(attr_name_in_parent) + 1 + node_name_len
+
+            end = closed_par + end
+            end_len += 1
+            # Going over the children backwards, the first printworthy one is the last to be printed, i.e. the one
+            # to close the parentheses, and the entries are gathered in the order they should be pushed in
+            children = n.children
+            child_entries = []
+            has_printworthy_child = False
+            for i in range(len(children) - 1, -1, -1):
+                child = children[i]
+                if printworthy(child):
+                    closes_here = close_early and not has_printworthy_child
+                    has_printworthy_child = True
+                elif debug:  # visited only to report that it was skipped
+                    closes_here = False
+                else:
+                    continue
+                child_entries.append((
                     child, n.field_name_for_child(i), depth + 1,
-                    end=(end if self._config.close_pars_early and child == last_printworthy_child else ''),
-                )
-
-            if not self._config.close_pars_early:
-                self._print(self._indent(depth, self._colorer.by_number(depth, ')')))
-        else:  # effectively a leaf
-            first_part += end
-            if not self._config.with_text:
-                self._print(first_part)
+                    end if closes_here else '', end_len if closes_here else 0,
+                ))
+
+            if not has_printworthy_child:  # effectively a leaf
+                first_part += end
+                first_part_len += end_len
+            if with_text:
+                node_line = n.start_point[0]
+                node_text_colored = self._obtain_second_color(n)(node_text)
+                column = self._column(first_part, first_part_len)
+                print_(f'{column}{gray(f"{node_line:>3}: ")}{node_text_colored}')
             else:
-                self._print(self._column(first_part) + second_part)
-        return True
+                print_(first_part)
+
+            if has_printworthy_child:
+                if not close_early:
+                    stack.append((None, None, depth, '', 0))
+                stack.extend(child_entries)
 
     def pprint(self, root: Node, *configs: Config):
         with self.configure(*configs):
@@ -204,8 +341,19 @@ class PrettySitter:
             if self._config.print_with_color and self._config.color_legend:
                 print('Color legend:', ', '.join(self._color_legend()))
 
-            self._print_node(root)
-
-            if self._config.use_pager and hasattr(self._print, 'pager_lines'):
-                sleep(1)
-                subprocess.run(['less', '-RS'], input='\n'.join(self._print.pager_lines), text=True)
+            with self._traversal(root):
+                if self._config.use_pager:
+                    # Make sure whatever was printed so far (e.g. the warnings) is out before the pager takes over
+                    sys.stdout.flush()
+                    sys.stderr.flush()
+                    # Exiting waits for the pager, also when interrupted, so that the two do not fight over the terminal
+                    with subprocess.Popen(['less', '-RS'], stdin=subprocess.PIPE, text=True) as pager:
+                        self._output = pager.stdin
+                        # The pager may be quit before the whole tree is printed
+                        with contextlib.suppress(BrokenPipeError):
+                            self._print_tree(root)
+                        with contextlib.suppress(BrokenPipeError):
+                            pager.stdin.close()
+                else:
+                    self._print_tree(root)
+                    sys.stdout.write(self._output.getvalue())
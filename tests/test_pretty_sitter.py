@@ -1,3 +1,5 @@
+import io
+import subprocess
 import textwrap
 
 import pytest
@@ -5,7 +7,7 @@ import tree_sitter_python
 from tree_sitter import Language, Node, Parser
 
 from pretty_sitter import PrettySitter
-from pretty_sitter.config import FilterConfig, MarkingConfig
+from pretty_sitter.config import FilterConfig, MarkingConfig, TTYConfig, UIConfig
 
 
 language_name = 'python'
@@ -50,3 +52,69 @@ def test_pprint(root: Node):
     )
     print()
     pretty_sitter.pprint(root, *extra_configs)
+
+
+def test_pprint_dotted(root: Node):
+    pretty_sitter = PrettySitter(
+        UIConfig(dotted=True),
+    )
+    print()
+    pretty_sitter.pprint(root)
+
+
+def test_pprint_deeply_nested(capsys: pytest.CaptureFixture[str]):
+    nesting = 800  # deeper than the recursion limit
+    code = 'x = ' + '(' * nesting + '1' + ')' * nesting + '\n'
+    root = parser.parse(bytes(code, 'utf8')).root_node
+
+    pretty_sitter = PrettySitter(
+        FilterConfig(only_types=['integer']),
+        UIConfig(print_with_color=False, indent_size=1),
+    )
+    pretty_sitter.pprint(root)
+
+    lines = capsys.readouterr().out.splitlines()
+    # module, expression_statement and assignment, then a parenthesized_expression per pair of parentheses
+    integer_depth = 3 + nesting
+    assert len(lines) == integer_depth + 1
+    assert lines[-1].startswith(' ' * integer_depth + '(integer)')
+    assert not any('identifier' in line for line in lines)
+
+
+class _PagerInput(io.StringIO):
+    def close(self):  # keep what was written readable once the pager is done with it
+        pass
+
+
+class _FakePager:
+    def __init__(self, args: list[str], **kwargs):
+        self.args = args
+        self.stdin = _PagerInput()
+
+    def __enter__(self) -> '_FakePager':
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+def test_pprint_pager(root: Node, monkeypatch: pytest.MonkeyPatch, capsys: pytest.CaptureFixture[str]):
+    pagers: list[_FakePager] = []
+
+    def popen(*args, **kwargs) -> _FakePager:
+        pagers.append(pager := _FakePager(*args, **kwargs))
+        return pager
+
+    monkeypatch.setattr(subprocess, 'Popen', popen)
+
+    pretty_sitter = PrettySitter(
+        TTYConfig(use_pager=True),
+        UIConfig(print_with_color=False),
+    )
+    pretty_sitter.pprint(root)
+
+    assert [pager.args for pager in pagers] == [['less', '-RS']]
+    lines = pagers[0].stdin.getvalue().splitlines()
+    assert lines[0].startswith('(module ')
+    assert any(line.lstrip().startswith('name: (identifier)') for line in lines)
+    assert '(module' not in capsys.readouterr().out